@@ -1,29 +1,162 @@
 #!/usr/bin/env python
 
-import time
-import json
+import os
+import re
+import bz2
+import gzip
+import lzma
+import mmap
+import hashlib
 import argparse
+from queue import Queue
+from threading import Event
+from threading import Thread
+from collections import deque
+from functools import partial
+from functools import cached_property
+from operator import attrgetter
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from contextlib import contextmanager
+from contextlib import nullcontext
 from pathlib import Path
 from datetime import datetime
-from html.parser import HTMLParser
+from datetime import timezone
+from datetime import timedelta
+from html import unescape
 
 from typing import Optional
+from typing import Sequence
 
+import orjson
 import tweepy
 from tqdm import tqdm
-from tqdm import trange
 from mastodon import Mastodon
 from elasticsearch import Elasticsearch
-from elasticsearch.helpers import bulk
+from elasticsearch.helpers import parallel_bulk
+from elasticsearch.helpers import BulkIndexError
 from elasticsearch.exceptions import NotFoundError
+from elasticsearch.exceptions import SerializationError
+from elasticsearch.serializer import JSONSerializer
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+# Length of the JavaScript assignment in front of the JSON in Twitter Archive
+# files, e.g. "window.YTD.tweet.part0 = [...]"
+_TWEET_PREFIX_LEN = len(b'window.YTD.tweet.part0 = ')
+_LIKE_PREFIX_LEN = len(b'window.YTD.like.part0 = ')
+
+# Openers for compressed JSON Lines files, by file extension
+_DECOMPRESSORS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+_JL_SUFFIXES = tuple(
+    ext + compression
+    for ext in ('.jl', '.jsonl')
+    for compression in ('', *_DECOMPRESSORS)
+)
+
+# Monthly files of older Twitter Archives are named like 2010_08.js
+_MONTHLY_FILE_RE = re.compile(r'(\d{4})_(\d{2})$')
+
+# Twitter snowflake ids start with a timestamp in milliseconds since this
+# epoch. Ids from before November 2010 are far below _SNOWFLAKE_MIN.
+_SNOWFLAKE_EPOCH_MS = 1288834974657
+_SNOWFLAKE_MIN = 1 << 40
+
+# Serialize datetimes (e.g. created_at of toots) natively in orjson. Naive
+# datetimes are taken as UTC, which is also how Elasticsearch reads them.
+# Offsets are kept as "+00:00" rather than "Z" to match statuses already in
+# the index.
+_ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC
+
+# Matches HTML tags in toot content
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+
+# Lookup tables for parsing created_at without strptime
+_MONTH_ABBR = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12,
+}
+_TZ_CACHE = {'+0000': timezone.utc}
+
+
+def _tz(offset: str) -> timezone:
+    '''Return a cached tzinfo for a UTC offset like "+0800".'''
+
+    tz = _TZ_CACHE.get(offset)
+    if tz is None:
+        delta = timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5]))
+        tz = _TZ_CACHE[offset] = timezone(-delta if offset[0] == '-' else delta)
+    return tz
+
+
+def _status_id_key(status_id):
+    '''Sort key of a status id. Twitter and Mastodon ids are ints or decimal
+    strings, but Pleroma ids are base62 flake ids such as 9wMNjRnfvh3UjvtiKm,
+    so int() cannot be used. Comparing the length first orders decimal ids
+    as numbers, and ids of the same length in either form sort as strings.'''
+
+    status_id = str(status_id)
+    return (len(status_id), status_id)
+
+
+def _parse_archive_js(filename: Path, prefix_len: int):
+    '''Parse a Twitter Archive file such as tweet.js, skipping the JavaScript
+    assignment in front of the JSON.
+
+    The file is mapped and parsed through a memoryview, so the raw archive is
+    never copied into memory next to the parsed data.'''
+
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        with memoryview(mm)[prefix_len:] as js:
+            return orjson.loads(js)
+
+
+def _js_file_month(js_file: Path):
+    '''Return (year, month) of a monthly js file of an older Twitter Archive.
+    Files not named after a month sort after every month.'''
+
+    match = _MONTHLY_FILE_RE.search(js_file.stem)
+    if match is None:
+        return (9999, 99)
+    return (int(match[1]), int(match[2]))
+
+
+def _parse_js_file(js_file: Path, since_id: int = 0):
+    '''Parse a monthly js file of an older Twitter Archive and return the
+    tweets newer than since_id. Runs in a worker process.'''
+
+    with open(js_file, 'rb') as f:
+        # Skip the first line
+        # e.g. Grailbird.data.tweets_2009_06 =
+        f.readline()
+        data = orjson.loads(f.read())
+    return [tweet for tweet in data if tweet['id'] > since_id]
 
 
 class TweetsLoader:
 
     tokens_filename = Path('tokens.json')
 
-    def __init__(self, screen_name: Optional[str] = None, since_id: Optional[int] = None, user_dict: Optional[dict] = None):
-        self.since_id = since_id or 0
+    def __init__(
+        self, screen_name: Optional[str] = None, since_id: Optional[int] = None, user_dict: Optional[dict] = None,
+        stream: bool = False,
+    ):
+        if stream and ijson is None:
+            raise ValueError('Streaming tweet.js requires ijson. Please install it with: pip install ijson')
+        self.stream = stream
+        # The last status in the index has a string id if it was ingested
+        # from tweet.js; cast it once here instead of in every comparison.
+        self.since_id = int(since_id or 0)
         self.user_dict = user_dict
         # scree_name provided by the user must match screen_name in the index.
         if screen_name and user_dict:
@@ -33,23 +166,21 @@ class TweetsLoader:
                     f'does not match the screen_name ({screen_name}) in the index.'
                 )
         self.screen_name = screen_name
-        self._api = None
 
     def load(self, source: str):
+        path = Path(source)
         if source.startswith('api:'):
-            screen_name = source.split(':')[1]
-            tweets = self.load_tweets_from_api(screen_name)
+            tweets = self.load_tweets_from_api(source[len('api:'):])
         elif source.startswith('api-fav:'):
-            screen_name = source.split(':')[1]
-            tweets = self.load_tweets_from_api(screen_name, api_name='favorites')
-        elif Path(source).name.startswith(('tweet.js', 'tweets.js', 'tweets-part')):
-            tweets = self.load_tweets_from_js(Path(source))
-        elif source.endswith(('.jl', '.jsonl')):
-            tweets = self.load_tweets_from_jl(Path(source))
-        elif Path(source).is_dir():
-            tweets = self.load_tweets_from_js_dir(Path(source))
-        elif Path(source).name == 'like.js':
-            tweets = self.load_tweets_from_like_js(Path(source))
+            tweets = self.load_tweets_from_api(source[len('api-fav:'):], api_name='favorites')
+        elif path.name.startswith(('tweet.js', 'tweets.js', 'tweets-part')):
+            tweets = self.load_tweets_from_js(path)
+        elif source.endswith(_JL_SUFFIXES):
+            tweets = self.load_tweets_from_jl(path)
+        elif path.name == 'like.js':
+            tweets = self.load_tweets_from_like_js(path)
+        elif path.is_dir():
+            tweets = self.load_tweets_from_js_dir(path)
         else:
             raise ValueError('Invalid source. Please see documentation for a list of supported sources.')
         return tweets
@@ -79,46 +210,80 @@ class TweetsLoader:
     def load_tweets_from_js(self, filename: Path):
         '''Newer Twitter Archives have a single tweet.js file.'''
 
-        with open(filename, 'r') as f:
-            js = f.read()
+        if self.stream:
+            yield from self.stream_tweets_from_js(filename)
+            return
 
-        #js = js.removeprefix('window.YTD.tweet.part0 = ')
-        prefix = 'window.YTD.tweet.part0 = '
-        js = js[len(prefix):]
-        data = json.loads(js)
-        for item in data:
-            tweet = item['tweet']
-            if int(tweet['id']) > int(self.since_id):
-                tweet = self.inject_user_dict(tweet)
-                yield tweet
+        data = _parse_archive_js(filename, _TWEET_PREFIX_LEN)
+
+        if self.since_id:
+            # Archive ids are decimal strings without leading zeros: a longer
+            # id is a larger one, and ids of the same length order the same as
+            # strings as they do as ints. Comparing them that way saves an
+            # int() call per tweet.
+            since_id = str(self.since_id)
+            digits = len(since_id)
+            data = [
+                item for item in data
+                if len(tweet_id := item['tweet']['id']) > digits or (len(tweet_id) == digits and tweet_id > since_id)
+            ]
+
+        # inject_user_dict() is still called once per tweet, but map() and
+        # yield from drive the iteration, which saves the bytecode of a for
+        # loop body and a separate yield for every tweet.
+        yield from map(self.inject_user_dict, map(itemgetter('tweet'), data))
+
+    def stream_tweets_from_js(self, filename: Path):
+        '''Parse tweet.js incrementally with ijson, so that memory usage does
+        not grow with the size of the archive. Slower than parsing the whole
+        file with orjson.'''
+
+        with open(filename, 'rb') as f:
+            f.seek(_TWEET_PREFIX_LEN)
+            for tweet in ijson.items(f, 'item.tweet', use_float=True):
+                if int(tweet['id']) > self.since_id:
+                    tweet = self.inject_user_dict(tweet)
+                    yield tweet
 
     def load_tweets_from_js_dir(self, js_dir: Path):
         '''Older Twitter Archives have a directory with monthly js files.'''
 
         js_files = sorted(js_dir.glob('*.js'))
-        for js_file in js_files:
-            with open(js_file, 'r') as f:
-                # Remove the first line
-                # e.g. Grailbird.data.tweets_2009_06 =
-                content = ''.join(f.readlines()[1:])
-                data = json.loads(content)
-            for tweet in data:
-                if tweet['id'] > self.since_id:
-                    tweet = self.inject_user_dict(tweet)
-                    yield tweet
+        if self.since_id >= _SNOWFLAKE_MIN:
+            # Skip the monthly files older than since_id. Allow a day of
+            # margin, as the archive may split months in local time.
+            since = datetime.fromtimestamp(
+                ((self.since_id >> 22) + _SNOWFLAKE_EPOCH_MS) / 1000, tz=timezone.utc
+            ) - timedelta(days=1)
+            cutoff = (since.year, since.month)
+            js_files = [
+                js_file for js_file in js_files
+                if _js_file_month(js_file) >= cutoff
+            ]
+        parse = partial(_parse_js_file, since_id=self.since_id)
+
+        # Parse the monthly files in parallel. map() returns the results in
+        # the order of js_files, so tweets are still yielded in order. A
+        # single file is not worth the cost of starting worker processes.
+        if len(js_files) > 1:
+            executor = ProcessPoolExecutor(max_workers=min(len(js_files), os.cpu_count() or 1))
+        else:
+            executor = None
+        with executor or nullcontext():
+            results = executor.map(parse, js_files, chunksize=1) if executor else map(parse, js_files)
+            for data in results:
+                yield from map(self.inject_user_dict, data)
 
-    @property
+    @cached_property
     def api(self):
-        if self._api:
-            return self._api
-
         # Authenticate against Twitter API
-        with open(self.tokens_filename, 'r') as f:
-            tokens = json.load(f)
+        with open(self.tokens_filename, 'rb') as f:
+            tokens = orjson.loads(f.read())
         auth = tweepy.OAuthHandler(tokens['ck'], tokens['cs'])
         auth.set_access_token(tokens['atk'], tokens['ats'])
-        self._api = tweepy.API(auth)
-        return self._api
+        # Let tweepy track x-rate-limit-remaining / x-rate-limit-reset and
+        # sleep until the window resets, instead of a blind 15 min sleep.
+        return tweepy.API(auth, wait_on_rate_limit=True, wait_on_rate_limit_notify=True)
 
     def load_tweets_from_api(self, screen_name: str, api_name: str = 'user_timeline'):
         '''Load tweets from Twitter API.'''
@@ -132,19 +297,7 @@ class TweetsLoader:
             kwargs['since_id'] = self.since_id
         cursor = tweepy.Cursor(getattr(self.api, api_name), **kwargs).items()
 
-        def status_iterator(cursor):
-            while True:
-                try:
-                    status = next(cursor)
-                    tqdm.write(f'Ingesting tweet {status.id} by {status.user.screen_name} created at {status.created_at}...')
-                    yield status
-                except tweepy.RateLimitError:
-                    tqdm.write('Rate limit reached. Sleep 15 min.')
-                    time.sleep(15 * 60)
-                except StopIteration:
-                    break
-
-        for status in status_iterator(cursor):
+        for status in cursor:
             if api_name == 'user_timeline':
                 tweet = self.inject_user_dict(status._json)
             else:
@@ -152,11 +305,17 @@ class TweetsLoader:
             yield tweet
 
     def load_tweets_from_jl(self, filename: Path):
-        '''Load tweets from jsonl files for testing purposes.'''
+        '''Load tweets from jsonl files for testing purposes. The files may be
+        compressed with gzip, bzip2 or xz.'''
 
-        with open(filename, 'r') as f:
+        decompressor = _DECOMPRESSORS.get(filename.suffix)
+        if decompressor:
+            f = decompressor(filename, 'rb')
+        else:
+            f = open(filename, 'rb', buffering=1024 * 1024)
+        with f:
             for line in f:
-                tweet = json.loads(line)
+                tweet = orjson.loads(line)
                 if tweet['id'] > self.since_id:
                     tweet = self.inject_user_dict(tweet)
                     yield tweet
@@ -164,12 +323,7 @@ class TweetsLoader:
     def load_tweets_from_like_js(self, filename: Path):
         '''Load tweets from like.js file.'''
 
-        with open(filename, 'r') as f:
-            js = f.read()
-
-        prefix = 'window.YTD.like.part0 = '
-        js = js[len(prefix):]
-        data = json.loads(js)
+        data = _parse_archive_js(filename, _LIKE_PREFIX_LEN)
 
         # Get a list of sorted tweet ids
         tweet_ids = sorted(datum['like']['tweetId'] for datum in data)
@@ -177,19 +331,30 @@ class TweetsLoader:
         # Look up tweets by id, up to 100 at a time
         # https://docs.tweepy.org/en/v3.10.0/api.html#API.statuses_lookup
         chunk_size = 100
-        for i in trange(0, len(tweet_ids), chunk_size):
-            chunk = tweet_ids[i:i + chunk_size]
-            while True:
-                try:
-                    statuses = self.api.statuses_lookup(chunk, include_entities=True)
-                    if statuses:
-                        break
-                except tweepy.RateLimitError:
-                    tqdm.write('Rate limit reached. Sleep 15 min.')
-                    time.sleep(15 * 60)
-            tweets = [self.inject_user_dict(status._json) for status in statuses]  # type: ignore
-            for tweet in tweets:
-                yield tweet
+        chunks = [tweet_ids[i:i + chunk_size] for i in range(0, len(tweet_ids), chunk_size)]
+        api = self.api
+
+        def lookup(chunk):
+            # An empty response is usually transient, but it is also what we
+            # get when every tweet in the chunk has been deleted, so do not
+            # retry forever.
+            for _ in range(3):
+                statuses = api.statuses_lookup(chunk, include_entities=True)
+                if statuses:
+                    return statuses
+            return []
+
+        # Keep a few lookups in flight to hide the latency of each request.
+        # Results are yielded as they complete, not in id order.
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            futures = [executor.submit(lookup, chunk) for chunk in chunks]
+            try:
+                for future in tqdm(as_completed(futures), total=len(futures), mininterval=0.5):
+                    yield from map(self.inject_user_dict, map(attrgetter('_json'), future.result()))
+            finally:
+                # If the consumer stops early (or a lookup fails), do not wait
+                # for the lookups that have not started yet.
+                executor.shutdown(cancel_futures=True)
 
 
 class MastodonLoader:
@@ -197,7 +362,6 @@ class MastodonLoader:
 
     def __init__(self, fqn: Optional[str] = None, since_id: Optional[str] = None) -> None:
         self.fqn = fqn
-        self._api = None
         self.since_id = since_id
 
     def load(self, source: str):
@@ -213,89 +377,219 @@ class MastodonLoader:
             raise NotImplementedError()
         return toots
 
-    @property
+    @cached_property
     def api(self):
-        if self._api:
-            return self._api
-
         # Authenticate against Mastodon API
-        with open(self.tokens_filename, 'r') as f:
-            tokens = json.load(f)
-        self._api = Mastodon(
+        with open(self.tokens_filename, 'rb') as f:
+            tokens = orjson.loads(f.read())
+        return Mastodon(
             api_base_url=tokens['api_base_url'],
             access_token=tokens['access_token'],
             version_check_mode='none',
         )
-        return self._api
 
     def _strip_html_tags(self, html: str):
-        parser = HTMLTagStripper()
-        parser.feed(html)
-        return parser.get_data()
+        return unescape(_HTML_TAG_RE.sub('', html))
 
-    def load_toots_from_api(self, user_id: str):
-        '''Use an infinite loop to load toots from Mastodon API. If since_id is
-        set, the loop stops when it is reached; else, the loop stops until API
-        returns empty array or throws exception.'''
+    def _fetch_pages(self, user_id: str, pages: Queue, stop: Event):
+        '''Fetch pages of toots into the queue until since_id or the end of
+        the timeline is reached, then put an empty page. Runs in a background
+        thread so that the next page is fetched while the current one is
+        being ingested.'''
 
         max_id = None
-        reached_since_id = False
-        while not reached_since_id:
-            toots = self.api.account_statuses(user_id, max_id=max_id)
-            if not toots:
-                break
-
-            for toot in toots:
-                toot_id = toot['id']
-                created_at = toot['created_at']
-                toot['content_text'] = self._strip_html_tags(toot['content'])
-                if self.since_id and toot_id <= self.since_id:
-                    reached_since_id = True
+        try:
+            while not stop.is_set():
+                toots = self.api.account_statuses(user_id, max_id=max_id)
+                pages.put(toots)
+                if not toots or (self.since_id and toots[-1]['id'] <= self.since_id):
                     break
-                else:
-                    tqdm.write(f'Ingesting toot {toot_id} by {toot["account"]["fqn"]} created at {created_at}...')
+                max_id = toots[-1]['id']
+            pages.put([])
+        except Exception as e:
+            pages.put(e)
+
+    def load_toots_from_api(self, user_id: str):
+        '''Load toots from Mastodon API, page by page. If since_id is set, the
+        loop stops when it is reached; else, the loop stops until API returns
+        empty array or throws exception.'''
+
+        # Authenticate before starting the fetcher so errors surface here.
+        self.api
+        pages: Queue = Queue(maxsize=2)
+        stop = Event()
+        Thread(target=self._fetch_pages, args=(user_id, pages, stop), daemon=True).start()
+        try:
+            while True:
+                toots = pages.get()
+                if isinstance(toots, Exception):
+                    raise toots
+                if not toots:
+                    break
+
+                for toot in toots:
+                    toot['content_text'] = self._strip_html_tags(toot['content'])
+                    if self.since_id and toot['id'] <= self.since_id:
+                        return
                     yield toot
+        finally:
+            # Unblock the fetcher if it is waiting for room in the queue.
+            stop.set()
+            while not pages.empty():
+                pages.get_nowait()
 
-            # If since_id is not yet reached or not set at all, start again
-            # with a new max_id
-            else:
-                max_id = toots[-1]['id']
 
+class StateCache:
+    '''Remember the last ingested status of each index on disk, so that
+    incremental runs do not have to ask Elasticsearch for it.'''
 
-class HTMLTagStripper(HTMLParser):
+    cache_dir = Path.home() / '.cache' / 'tbeat'
 
-    def __init__(self):
-        self.reset()
-        self.strict = False
-        self.convert_charrefs = True
-        self.fed = []
+    def __init__(self, es_url: str):
+        self.es_url = es_url
 
-    def handle_data(self, d):
-        self.fed.append(d)
+    def _path(self, index: str) -> Path:
+        # The same index name on different clusters must not share a cache
+        # file, so key it by the URL too. Hash it since the URL may contain
+        # credentials and characters that are not valid in file names.
+        digest = hashlib.sha256(f'{self.es_url}/{index}'.encode()).hexdigest()
+        return self.cache_dir / f'{index}-{digest[:16]}.json'
 
-    def get_data(self):
-        return ''.join(self.fed)
+    def get(self, index: str) -> Optional[dict]:
+        try:
+            with open(self._path(index), 'rb') as f:
+                return orjson.loads(f.read())
+        except (FileNotFoundError, orjson.JSONDecodeError):
+            return None
+
+    def set(self, index: str, status: dict):
+        # Only keep what main() needs from the last status.
+        state = {
+            'id': status['id'],
+            'created_at': status['created_at'],
+            '@timestamp': status['@timestamp'],
+        }
+        if status.get('user'):
+            state['user'] = {'screen_name': status['user'].get('screen_name')}
+        if status.get('account'):
+            state['account'] = {'fqn': status['account'].get('fqn')}
+
+        # Write to a temporary file and rename it over the old one, so that
+        # an interrupted write never leaves a truncated cache behind.
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(index)
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(orjson.dumps(state))
+        os.replace(tmp_path, path)
+
+
+class OrjsonSerializer(JSONSerializer):
+    '''Drop-in replacement of the client's JSONSerializer backed by orjson.'''
+
+    def dumps(self, data):
+        if isinstance(data, (str, bytes)):
+            return data
+        try:
+            return orjson.dumps(data, default=self.default, option=_ORJSON_OPTIONS).decode()
+        except TypeError as e:
+            raise SerializationError(data, e)
+
+    def loads(self, s):
+        try:
+            return orjson.loads(s)
+        except ValueError as e:
+            raise SerializationError(s, e)
 
 
 class ElasticsearchIngester:
 
-    def __init__(self, es_url, index):
-        self.es = Elasticsearch(es_url)
+    def __init__(
+        self, es_url, index,
+        thread_count: int = 4, queue_size: int = 4,
+        chunk_size: int = 2000, max_chunk_bytes: int = 10 * 1024 * 1024,
+        fast_ingest: bool = False, append_only: bool = False, raw_bulk: bool = False,
+        strip_fields: Sequence[str] = (), http_compress: bool = True,
+    ):
+        # Statuses compress well, so gzip the bulk requests unless told not
+        # to (e.g. when Elasticsearch runs on localhost). urllib3 keeps
+        # connections alive between requests; size the pool so that every
+        # bulk thread always has one of its own and never has to reconnect.
+        # A timed out bulk request may still have been applied; resending it
+        # is harmless when statuses are indexed by id, but with generated ids
+        # (append_only) it would duplicate them.
+        self.es = Elasticsearch(
+            es_url,
+            serializer=OrjsonSerializer(),
+            http_compress=http_compress,
+            maxsize=max(16, thread_count + 1),
+            timeout=120,
+            retry_on_timeout=not append_only,
+            max_retries=3,
+        )
         self.index = index
+        self.thread_count = thread_count
+        self.queue_size = queue_size
+        # A chunk is flushed when either limit is hit. Keep
+        # chunk_size <= max_chunk_bytes / avg_doc_size so that chunk_size is
+        # the one that applies; tweets are ~3-5 KiB, so 2000 of them fit in
+        # 10 MiB.
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.fast_ingest = fast_ingest
+        # Without an explicit _id Elasticsearch can skip the lookup for an
+        # existing document with the same id.
+        self.append_only = append_only
+        self.raw_bulk = raw_bulk
+        self.strip_fields = tuple(strip_fields)
+        # The status with the latest @timestamp seen by the last ingest()
+        self.last_status = None
 
     def get_last_status(self):
+        # Find the latest @timestamp with an aggregation over doc values, and
+        # only then fetch the statuses that have it. Aggregating on id would
+        # not work, as it is a string for some sources.
         try:
             resp = self.es.search(
                 index=self.index,
                 body={
-                    'sort': [{'@timestamp': 'desc'}],
+                    'size': 0,
+                    'aggs': {'last_timestamp': {'max': {'field': '@timestamp'}}},
                 }
-            )['hits']['hits']
+            )
         except NotFoundError:
             return None
 
-        if len(resp) > 0:
-            last_status = resp[0]['_source']
+        last_timestamp = resp['aggregations']['last_timestamp']['value']
+        if last_timestamp is None:
+            return None
+
+        # Only fetch what main() needs, not the whole status.
+        source = ['id', 'created_at', '@timestamp', 'user.screen_name', 'account.fqn']
+        # Several statuses can share the same second; the newest of them is
+        # the one with the highest id. id is not sortable in every mapping
+        # (it is a string for some sources), so compare the ids here.
+        hits = self.es.search(
+            index=self.index,
+            body={
+                'size': 100,
+                'query': {'term': {'@timestamp': int(last_timestamp)}},
+                '_source': source,
+            }
+        )['hits']['hits']
+        if not hits:
+            # Should not happen, but fall back to sorting the whole index
+            # rather than reporting an empty one.
+            hits = self.es.search(
+                index=self.index,
+                body={
+                    'size': 1,
+                    'sort': [{'@timestamp': 'desc'}],
+                    '_source': source,
+                }
+            )['hits']['hits']
+        if len(hits) > 0:
+            last_status = max(hits, key=lambda hit: _status_id_key(hit['_source']['id']))['_source']
         else:
             last_status = None
         return last_status
@@ -304,26 +598,191 @@ class ElasticsearchIngester:
         if isinstance(timestamp, datetime):
             return timestamp
 
+        # Tell the two known formats apart up front, so that the common case
+        # neither raises nor goes through strptime, which re-parses the format
+        # string on every call.
+        if timestamp[4:5] == '-':
+            # Legacy Twitter Archive: 2008-08-27 13:08:45 +0000
+            if len(timestamp) == 25 and timestamp[19] == ' ':
+                try:
+                    return datetime.fromisoformat(f'{timestamp[:19]}{timestamp[20:23]}:{timestamp[23:25]}')
+                except ValueError:
+                    pass
+            return datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S %z')
+
+        # Twitter API / Archive: Wed Aug 27 13:08:45 +0000 2008
+        month = _MONTH_ABBR.get(timestamp[4:7])
+        if month and len(timestamp) == 30 and timestamp[19] == ' ' and timestamp[25] == ' ':
+            try:
+                return datetime(
+                    int(timestamp[26:30]), month, int(timestamp[8:10]),
+                    int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19]),
+                    tzinfo=_tz(timestamp[20:25]),
+                )
+            except ValueError:
+                pass
+        return datetime.strptime(timestamp, '%a %b %d %H:%M:%S %z %Y')
+
+    def format_timestamp(self, timestamp) -> str:
+        '''Return created_at as an ISO 8601 string for @timestamp.
+
+        The known string formats are rearranged directly, without building a
+        datetime just for the serializer to turn it back into a string.'''
+
+        if isinstance(timestamp, str):
+            # The slices are copied through as they are, so check that they
+            # are digits; anything else goes through parse_timestamp() and
+            # fails there instead of in Elasticsearch.
+            if len(timestamp) == 30 and timestamp[19] == ' ' and timestamp[25] == ' ':
+                # Twitter API / Archive: Wed Aug 27 13:08:45 +0000 2008
+                month = _MONTH_ABBR.get(timestamp[4:7])
+                if (
+                    month
+                    and timestamp[13] == timestamp[16] == ':'
+                    and timestamp[20] in '+-'
+                    and (
+                        timestamp[8:10] + timestamp[11:13] + timestamp[14:16] + timestamp[17:19]
+                        + timestamp[21:25] + timestamp[26:30]
+                    ).isdigit()
+                ):
+                    return (
+                        f'{timestamp[26:30]}-{month:02d}-{timestamp[8:10]}T{timestamp[11:19]}'
+                        f'{timestamp[20:23]}:{timestamp[23:25]}'
+                    )
+            elif len(timestamp) == 25 and timestamp[4] == '-' and timestamp[19] == ' ':
+                # Legacy Twitter Archive: 2008-08-27 13:08:45 +0000
+                if (
+                    timestamp[7] == '-'
+                    and timestamp[10] == ' '
+                    and timestamp[13] == timestamp[16] == ':'
+                    and timestamp[20] in '+-'
+                    and (
+                        timestamp[0:4] + timestamp[5:7] + timestamp[8:10] + timestamp[11:13]
+                        + timestamp[14:16] + timestamp[17:19] + timestamp[21:25]
+                    ).isdigit()
+                ):
+                    return f'{timestamp[0:10]}T{timestamp[11:19]}{timestamp[20:23]}:{timestamp[23:25]}'
+        return self.parse_timestamp(timestamp).isoformat()
+
+    @contextmanager
+    def bulk_load_settings(self):
+        '''Disable refresh and replicas of the index while bulk loading, and
+        restore them afterwards.'''
+
+        if not self.es.indices.exists(index=self.index):
+            self.es.indices.create(index=self.index)
+        resp = self.es.indices.get_settings(index=self.index, flat_settings=True)
+        settings = next(iter(resp.values()))['settings']
+        # A missing key means the setting is at its default; putting None
+        # resets it to the default again.
+        restore = {
+            'index.refresh_interval': settings.get('index.refresh_interval'),
+            'index.number_of_replicas': settings.get('index.number_of_replicas'),
+        }
+        self.es.indices.put_settings(index=self.index, body={
+            'index.refresh_interval': '-1',
+            'index.number_of_replicas': 0,
+        })
         try:
-            r = datetime.strptime(timestamp, '%a %b %d %H:%M:%S %z %Y')
-        except ValueError:
-            r = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S %z')
-        return r
+            yield
+            # Merge while there are no replicas to copy the segments to.
+            self.es.indices.forcemerge(index=self.index, max_num_segments=5, request_timeout=600)
+        finally:
+            self.es.indices.put_settings(index=self.index, body=restore)
+
+    def send_raw_bulk(self, actions):
+        '''Serialize actions with orjson and send them as raw NDJSON bodies of
+        the bulk API, bypassing the per-action serialization in
+        elasticsearch.helpers.'''
+
+        def gen_bodies():
+            lines = []
+            size = 0
+            for action in actions:
+                source = action.pop('_source')
+                # What is left in the action (_index and _id) is exactly the
+                # metadata line of the bulk API.
+                meta_line = orjson.dumps({'index': action})
+                source_line = orjson.dumps(source, option=_ORJSON_OPTIONS)
+                action_size = len(meta_line) + len(source_line) + 2
+                # Flush before the body would grow past max_chunk_bytes, so
+                # that only a single oversized action can exceed it.
+                if lines and (
+                    len(lines) >= 2 * self.chunk_size or size + action_size > self.max_chunk_bytes
+                ):
+                    yield b'\n'.join(lines) + b'\n'
+                    lines = []
+                    size = 0
+                lines.append(meta_line)
+                lines.append(source_line)
+                size += action_size
+            if lines:
+                yield b'\n'.join(lines) + b'\n'
+
+        def send(body):
+            resp = self.es.bulk(body=body, request_timeout=120)
+            if resp['errors']:
+                errors = [item for item in resp['items'] if next(iter(item.values())).get('error')]
+                raise BulkIndexError(f'{len(errors)} document(s) failed to index.', errors)
+
+        # Like parallel_bulk(), only keep a bounded number of bodies in flight.
+        with ThreadPoolExecutor(max_workers=self.thread_count) as executor:
+            futures = deque()
+            for body in gen_bodies():
+                futures.append(executor.submit(send, body))
+                if len(futures) >= self.thread_count + self.queue_size:
+                    futures.popleft().result()
+            for future in futures:
+                future.result()
 
     def ingest(self, statuses):
+        self.last_status = None
 
         def gen_actions():
-            for status in tqdm(statuses):
-                timestamp = self.parse_timestamp(status['created_at'])
-                status['@timestamp'] = timestamp
-                action = {
-                    '_index': self.index,
-                    '_id': status['id'],
-                    '_source': status,
-                }
-                yield action
+            # Bind attributes to locals, as this loop runs once per status.
+            index = self.index
+            append_only = self.append_only
+            format_timestamp = self.format_timestamp
+            strip_fields = self.strip_fields
+            last_status = None
+            # This bar is the only progress report, also for slow API sources.
+            # Redraw it at most once a second; tqdm adapts how often it checks
+            # the clock to the rate of statuses.
+            for status in tqdm(statuses, mininterval=1.0, smoothing=0.05, unit='status'):
+                for field in strip_fields:
+                    status.pop(field, None)
+                timestamp = status['@timestamp'] = format_timestamp(status['created_at'])
+                # All statuses are in UTC, so the ISO strings sort by time.
+                # Break ties by id like get_last_status() does, since some
+                # sources are not in order.
+                if (
+                    last_status is None
+                    or timestamp > last_status['@timestamp']
+                    or (
+                        timestamp == last_status['@timestamp']
+                        and _status_id_key(status['id']) > _status_id_key(last_status['id'])
+                    )
+                ):
+                    last_status = status
+                if append_only:
+                    yield {'_index': index, '_source': status}
+                else:
+                    yield {'_index': index, '_id': status['id'], '_source': status}
+            self.last_status = last_status
 
-        bulk(self.es, gen_actions())
+        with self.bulk_load_settings() if self.fast_ingest else nullcontext():
+            if self.raw_bulk:
+                self.send_raw_bulk(gen_actions())
+            else:
+                # parallel_bulk() is lazy; drain it to actually send the requests.
+                deque(parallel_bulk(
+                    self.es, gen_actions(),
+                    thread_count=self.thread_count,
+                    queue_size=self.queue_size,
+                    chunk_size=self.chunk_size,
+                    max_chunk_bytes=self.max_chunk_bytes,
+                    request_timeout=120,
+                ), maxlen=0)
 
 
 def main():
@@ -336,11 +795,56 @@ def main():
         'import statuses without checking existing ones first; '
         'useful when importing unsorted tweets from multiple files'
     ))
+    ap.add_argument('--threads', type=int, default=4, help='number of threads sending bulk requests, default is 4')
+    ap.add_argument('--queue-size', type=int, default=4, help='number of bulk chunks buffered for the threads, default is 4')
+    ap.add_argument('--chunk-size', type=int, default=2000, help='max number of statuses per bulk request, default is 2000')
+    ap.add_argument('--max-chunk-bytes', type=int, default=10 * 1024 * 1024, help='max size of a bulk request in bytes, default is 10 MiB')
+    ap.add_argument('--fast-ingest', action='store_true', help=(
+        'disable refresh and replicas of the index during the import and force merge it afterwards; '
+        'useful when importing a large archive'
+    ))
+    ap.add_argument('--append-only', action='store_true', help=(
+        'let Elasticsearch generate document IDs instead of using status IDs; '
+        'faster, but statuses that are already in the index will be duplicated'
+    ))
+    ap.add_argument('--raw-bulk', action='store_true', help=(
+        'serialize bulk requests with orjson instead of the Elasticsearch client'
+    ))
+    ap.add_argument('--strip-fields', default='', help=(
+        'comma-separated list of top-level fields to drop from statuses before importing, '
+        'e.g. display_text_range,truncated'
+    ))
+    ap.add_argument('--no-state-cache', action='store_true', help=(
+        'always query Elasticsearch for the last status instead of using the one cached in ~/.cache/tbeat'
+    ))
+    ap.add_argument('--stream', action='store_true', help=(
+        '(Twitter) parse tweet.js incrementally to keep memory usage low; requires ijson'
+    ))
+    ap.add_argument('--no-compress', action='store_true', help=(
+        'do not gzip requests to Elasticsearch; saves CPU when Elasticsearch is on the same host'
+    ))
     args = ap.parse_args()
 
-    ingester = ElasticsearchIngester(args.es, args.index)
+    strip_fields = [field for field in args.strip_fields.split(',') if field]
+    # These are needed to index statuses and to find the last one later.
+    required_fields = [field for field in strip_fields if field in ('id', 'created_at', '@timestamp')]
+    if required_fields:
+        ap.error(f'--strip-fields cannot include {", ".join(required_fields)}')
+
+    ingester = ElasticsearchIngester(
+        args.es, args.index,
+        thread_count=args.threads, queue_size=args.queue_size,
+        chunk_size=args.chunk_size, max_chunk_bytes=args.max_chunk_bytes,
+        fast_ingest=args.fast_ingest, append_only=args.append_only,
+        raw_bulk=args.raw_bulk,
+        strip_fields=strip_fields,
+        http_compress=not args.no_compress,
+    )
+    state_cache = StateCache(args.es or 'localhost')
     if not args.skip_last_status_check:
-        last_status = ingester.get_last_status()
+        last_status = None if args.no_state_cache else state_cache.get(args.index)
+        if not last_status:
+            last_status = ingester.get_last_status()
     else:
         last_status = None
     if last_status:
@@ -364,11 +868,20 @@ def main():
     if args.source.startswith('masto'):
         loader = MastodonLoader(last_user, since_id)
     else:
-        loader = TweetsLoader(last_user, since_id, user_dict)
+        loader = TweetsLoader(last_user, since_id, user_dict, stream=args.stream)
 
     statuses = loader.load(args.source)
     ingester.ingest(statuses)
 
+    # Only move the cached last status forward; with --skip-last-status-check
+    # the statuses we just ingested may be older than it.
+    new_last_status = ingester.last_status
+    cached_last_status = state_cache.get(args.index)
+    if new_last_status and (
+        not cached_last_status or new_last_status['@timestamp'] > cached_last_status['@timestamp']
+    ):
+        state_cache.set(args.index, new_last_status)
+
 
 if __name__ == '__main__':
     main()